@@ -1,9 +1,10 @@
-from fastapi import APIRouter, HTTPException,Query,Path,Body,HTTPException
+from fastapi import APIRouter, HTTPException,Query,Path,Body,HTTPException,Header
 from typing import List, Dict, Any
 from pydantic import BaseModel
 from datetime import date, datetime,timedelta, time as dtime
 from enum import Enum
 from db import fetch_all, fetch_one,execute
+from idempotency import run_idempotent
 
 router = APIRouter(prefix="/crew-members", tags=["crew-members"])
 
@@ -199,15 +200,7 @@ async def toggle_crew_status(crew_id: int = Path(..., ge=1)):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
-@router.post("/{crew_code}/checkin", response_model=dict)
-async def crew_checkin(
-    crew_code: str = Path(..., description="Crew code to check in"),
-    rest_time_minutes: int | None = Body(None, description="Optional rest time to set (minutes)")
-):
-    """
-    Mark crew as checked-in: sets check_in_date/check_in_time, clears previous check_out/rest_until.
-    Optionally set per-duty rest_time_minutes. Returns the updated timing row with time fields as "HH:MM:SS".
-    """
+async def _crew_checkin(crew_code: str, rest_time_minutes: int | None = None):
     try:
         now = datetime.utcnow()
         check_in_date = now.date()
@@ -278,59 +271,26 @@ async def crew_checkin(
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"DB error during checkin: {e}")
+@router.post("/{crew_code}/checkin", response_model=dict)
 async def crew_checkin(
     crew_code: str = Path(..., description="Crew code to check in"),
-    rest_time_minutes: int | None = Body(None, description="Optional rest time to set (minutes)")
+    rest_time_minutes: int | None = Body(None, description="Optional rest time to set (minutes)"),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
 ):
     """
     Mark crew as checked-in: sets check_in_date/check_in_time, clears previous check_out/rest_until.
-    Optionally set per-duty rest_time_minutes. Returns the updated timing row.
+    Optionally set per-duty rest_time_minutes. Returns the updated timing row with time fields as "HH:MM:SS".
+    A retry with the same Idempotency-Key returns the first response instead of checking in again.
     """
-    try:
-        now = datetime.utcnow()  # naive UTC datetime
-        check_in_date = now.date()
-        check_in_time = now.time().replace(microsecond=0)
-
-        existing = await fetch_one("SELECT * FROM crew_timing WHERE crew_code = %s LIMIT 1", (crew_code,))
-        if existing:
-            # update check-in, clear checkout/rest_until; keep rest_time_minutes if not provided
-            await execute(
-                """
-                UPDATE crew_timing
-                SET check_in_date = %s, check_in_time = %s,
-                    check_out_date = NULL, check_out_time = NULL,
-                    rest_until_date = NULL, rest_until_time = NULL,
-                    rest_time_minutes = CASE WHEN %s IS NULL THEN rest_time_minutes ELSE %s END,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE crew_code = %s
-                """,
-                (check_in_date, check_in_time, rest_time_minutes, rest_time_minutes, crew_code),
-            )
-        else:
-            rest_val = rest_time_minutes if rest_time_minutes is not None else 0
-            await execute(
-                """
-                INSERT INTO crew_timing (
-                  crew_code, check_in_date, check_in_time, rest_time_minutes, created_at, updated_at
-                ) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                """,
-                (crew_code, check_in_date, check_in_time, rest_val),
-            )
-
-        updated = await fetch_one("SELECT * FROM crew_timing WHERE crew_code = %s LIMIT 1", (crew_code,))
-        return {"status": "checked_in", "timing": updated}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"DB error during checkin: {e}")
+    payload = {"crew_code": crew_code.strip().upper(), "rest_time_minutes": rest_time_minutes}
+    return await run_idempotent(
+        idempotency_key, "checkin", payload, lambda: _crew_checkin(crew_code, rest_time_minutes)
+    )
 
 
 
 
-@router.post("/{crew_code}/checkout", response_model=dict)
-async def crew_checkout(crew_code: str = Path(..., description="Crew code to check out")):
-    """
-    Mark crew as checked-out: sets check_out_date/check_out_time, sets rest_until_date/rest_until_time based on rest_time_minutes.
-    Returns updated timing row with time fields formatted as "HH:MM:SS".
-    """
+async def _crew_checkout(crew_code: str):
     try:
         now = datetime.utcnow()
         check_out_date = now.date()
@@ -393,3 +353,19 @@ async def crew_checkout(crew_code: str = Path(..., description="Crew code to che
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"DB error during checkout: {e}")
+
+
+@router.post("/{crew_code}/checkout", response_model=dict)
+async def crew_checkout(
+    crew_code: str = Path(..., description="Crew code to check out"),
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Mark crew as checked-out: sets check_out_date/check_out_time, sets rest_until_date/rest_until_time based on rest_time_minutes.
+    Returns updated timing row with time fields formatted as "HH:MM:SS".
+    A retry with the same Idempotency-Key returns the first response, so rest_until is not pushed forward.
+    """
+    payload = {"crew_code": crew_code.strip().upper()}
+    return await run_idempotent(
+        idempotency_key, "checkout", payload, lambda: _crew_checkout(crew_code)
+    )
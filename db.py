@@ -122,6 +122,15 @@ async def execute(query: str, params: tuple = ()):
             await conn.commit()
             return cur.lastrowid
 
+async def execute_rowcount(query: str, params: tuple = ()) -> int:
+    """Like execute(), but returns the number of affected rows."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            await conn.commit()
+            return cur.rowcount
+
 async def get_pool_stats() -> Dict[str, Any]:
     global _pool
     if _pool is None:
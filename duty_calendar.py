@@ -0,0 +1,298 @@
+# duty_calendar.py
+import base64
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List
+
+import aiomysql
+from fastapi import APIRouter, HTTPException, Path
+
+from db import get_connection
+
+router = APIRouter(prefix="/calendar", tags=["calendar"])
+
+# One byte per crew per day. Codes are ordered by precedence so that when two
+# sources touch the same day the higher code wins (a simple max()).
+STATE_OFF = 0
+STATE_REST = 1
+STATE_STANDBY = 2
+STATE_LEAVE = 3
+STATE_DUTY = 4
+
+STATE_CODES = {
+    "off": STATE_OFF,
+    "rest": STATE_REST,
+    "standby": STATE_STANDBY,
+    "leave": STATE_LEAVE,
+    "duty": STATE_DUTY,
+}
+
+# Minimum rest after a duty (duty block or rostered flight); days it spills into are marked as rest.
+MIN_REST_HOURS = 10
+
+
+def month_bounds(day: date):
+    """Return (first_day, last_day, days_in_month) for the month containing `day`."""
+    first = day.replace(day=1)
+    next_first = (first + timedelta(days=32)).replace(day=1)
+    last = next_first - timedelta(days=1)
+    return first, last, last.day
+
+
+def _as_date(val) -> date:
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    return datetime.fromisoformat(str(val)).date()
+
+
+def _mark(states: bytearray, first: date, last: date, start: date, end: date, code: int):
+    """Raise every day of [start, end] that falls inside the month to at least `code`."""
+    start = max(start, first)
+    end = min(end, last)
+    d = start
+    while d <= end:
+        i = d.day - 1
+        if states[i] < code:
+            states[i] = code
+        d += timedelta(days=1)
+
+
+async def refresh_crew_calendar(cur, crew_ids: Iterable[int], day: date) -> int:
+    """
+    Recompute and upsert the calendar rows of `crew_ids` for the month containing `day`.
+    Runs on the caller's cursor so it commits (or rolls back) with the write that triggered it.
+    Returns the number of rows written.
+    """
+    crew_ids = sorted({int(c) for c in crew_ids})
+    if not crew_ids:
+        return 0
+
+    first, last, days = month_bounds(day)
+    placeholders = ",".join(["%s"] * len(crew_ids))
+    ids = tuple(crew_ids)
+
+    await cur.execute(
+        f"SELECT `id`, `base_airport` FROM `crew_members` WHERE `id` IN ({placeholders})",
+        ids,
+    )
+    bases = {int(r["id"]): r["base_airport"] for r in await cur.fetchall()}
+    states = {cid: bytearray(days) for cid in bases}
+
+    # rest window can carry a duty that ended the previous evening into day 1
+    window_start = datetime.combine(first, datetime.min.time()) - timedelta(hours=MIN_REST_HOURS)
+    window_end = datetime.combine(last + timedelta(days=1), datetime.min.time())
+
+    await cur.execute(
+        f"""
+        SELECT `crew_id`, `start_time`, `end_time`
+        FROM `duty_blocks`
+        WHERE `crew_id` IN ({placeholders})
+          AND `end_time` >= %s AND `start_time` < %s
+        """,
+        ids + (window_start, window_end),
+    )
+    for r in await cur.fetchall():
+        st = states.get(int(r["crew_id"]))
+        if st is None:
+            continue
+        rest_end = r["end_time"] + timedelta(hours=MIN_REST_HOURS)
+        _mark(st, first, last, _as_date(r["end_time"]), _as_date(rest_end), STATE_REST)
+        _mark(st, first, last, _as_date(r["start_time"]), _as_date(r["end_time"]), STATE_DUTY)
+
+    await cur.execute(
+        f"""
+        SELECT `crew_id`, `standby_date`
+        FROM `standby_assignments`
+        WHERE `crew_id` IN ({placeholders})
+          AND `standby_date` BETWEEN %s AND %s
+        """,
+        ids + (first, last),
+    )
+    for r in await cur.fetchall():
+        st = states.get(int(r["crew_id"]))
+        if st is not None:
+            d = _as_date(r["standby_date"])
+            _mark(st, first, last, d, d, STATE_STANDBY)
+
+    await cur.execute(
+        f"""
+        SELECT `crew_id`, `start_date`, `end_date`
+        FROM `crew_leaves`
+        WHERE `crew_id` IN ({placeholders})
+          AND `status` = 'approved'
+          AND `start_date` <= %s AND `end_date` >= %s
+        """,
+        ids + (last, first),
+    )
+    for r in await cur.fetchall():
+        st = states.get(int(r["crew_id"]))
+        if st is not None:
+            _mark(st, first, last, _as_date(r["start_date"]), _as_date(r["end_date"]), STATE_LEAVE)
+
+    # flights that landed late last month are included for the rest they carry into day 1
+    await cur.execute(
+        f"""
+        SELECT r.`crew_id`, r.`status`, f.`flight_date`, f.`arr_time`
+        FROM `rosters` r
+        JOIN `flights` f ON f.`id` = r.`flight_id`
+        WHERE r.`crew_id` IN ({placeholders})
+          AND r.`status` IN ('assigned','standby')
+          AND f.`status` <> 'cancelled'
+          AND f.`arr_time` >= %s AND f.`flight_date` <= %s
+        """,
+        ids + (window_start, last),
+    )
+    for r in await cur.fetchall():
+        st = states.get(int(r["crew_id"]))
+        if st is None:
+            continue
+        d = _as_date(r["flight_date"])
+        if r["status"] == "assigned":
+            # roster duty gets the same trailing rest as a duty block
+            arr = r["arr_time"]
+            _mark(st, first, last, _as_date(arr), _as_date(arr + timedelta(hours=MIN_REST_HOURS)), STATE_REST)
+            _mark(st, first, last, d, _as_date(arr), STATE_DUTY)
+        else:
+            _mark(st, first, last, d, d, STATE_STANDBY)
+
+    upsert_sql = """
+        INSERT INTO `crew_calendar` (`crew_id`,`month_start`,`base_airport`,`states`,`updated_at`)
+        VALUES (%s,%s,%s,%s,%s)
+        ON DUPLICATE KEY UPDATE
+          `base_airport` = VALUES(`base_airport`),
+          `states` = VALUES(`states`),
+          `updated_at` = VALUES(`updated_at`)
+    """
+    now = datetime.utcnow()
+    rows = [(cid, first, bases[cid], bytes(st), now) for cid, st in states.items()]
+    await cur.executemany(upsert_sql, rows)
+    return len(rows)
+
+
+async def refresh_crew_calendar_for_duty(cur, crew_ids: Iterable[int], start: datetime, end: datetime) -> int:
+    """
+    Refresh every month touched by a duty from `start` to `end`, including the month
+    its trailing rest spills into. Returns the number of rows written.
+    """
+    written = 0
+    month = month_bounds(_as_date(start))[0]
+    last = _as_date(end + timedelta(hours=MIN_REST_HOURS))
+    while month <= last:
+        written += await refresh_crew_calendar(cur, crew_ids, month)
+        month = month_bounds(month)[1] + timedelta(days=1)
+    return written
+
+
+def _parse_month(year: int, month: int) -> date:
+    try:
+        return date(year, month, 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid month {year}-{month:02d}")
+
+
+@router.get("/{base_airport}/{year}/{month}")
+async def get_base_month(
+    base_airport: str = Path(...),
+    year: int = Path(..., ge=2000, le=2100),
+    month: int = Path(..., ge=1, le=12),
+):
+    """
+    Return a whole base's month as one compact payload.
+
+    `states` is base64 of `len(crew_ids) * days` bytes: row i (crew_ids[i]) occupies
+    bytes [i*days, (i+1)*days), one state code per day (see `codes`). Crew without a
+    materialized row (never rostered since the calendar existed, seeded data) are built
+    from the source tables on this read and stored, so the first view of a month is slower.
+
+    Budget for 5,000 crew x 31 days: 155,000 raw bytes (~207 KB base64 plus ~35 KB of
+    crew ids), served from two indexed reads and no joins: the base's crew ids
+    (`idx_crew_members_base`) and its calendar rows (`idx_crew_calendar_base_month`);
+    target is under 200 ms server-side.
+    """
+    base = base_airport.strip().upper()
+    first, _, days = month_bounds(_parse_month(year, month))
+
+    try:
+        async with get_connection() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(
+                    "SELECT `id` FROM `crew_members` WHERE `base_airport` = %s ORDER BY `id`",
+                    (base,),
+                )
+                id_rows = await cur.fetchall()
+                await cur.execute(
+                    """
+                    SELECT `crew_id`, `states`
+                    FROM `crew_calendar`
+                    WHERE `base_airport` = %s AND `month_start` = %s
+                    """,
+                    (base, first),
+                )
+                stored = {int(r["crew_id"]): r["states"] for r in await cur.fetchall()}
+
+                # materialize on a miss instead of passing the gap off as real off days
+                missing = [int(r["id"]) for r in id_rows if int(r["id"]) not in stored]
+                if missing:
+                    await refresh_crew_calendar(cur, missing, first)
+                    placeholders = ",".join(["%s"] * len(missing))
+                    await cur.execute(
+                        f"""
+                        SELECT `crew_id`, `states`
+                        FROM `crew_calendar`
+                        WHERE `crew_id` IN ({placeholders}) AND `month_start` = %s
+                        """,
+                        tuple(missing) + (first,),
+                    )
+                    stored.update({int(r["crew_id"]): r["states"] for r in await cur.fetchall()})
+            await conn.commit()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch calendar: {e}")
+
+    buf = bytearray()
+    crew_ids: List[int] = []
+    for r in id_rows:
+        cid = int(r["id"])
+        crew_ids.append(cid)
+        buf += bytes(stored[cid])[:days].ljust(days, b"\x00")
+
+    return {
+        "base_airport": base,
+        "month": first.strftime("%Y-%m"),
+        "days": days,
+        "codes": STATE_CODES,
+        "crew_ids": crew_ids,
+        "states": base64.b64encode(bytes(buf)).decode("ascii"),
+    }
+
+
+@router.post("/{base_airport}/{year}/{month}/rebuild")
+async def rebuild_base_month(
+    base_airport: str = Path(...),
+    year: int = Path(..., ge=2000, le=2100),
+    month: int = Path(..., ge=1, le=12),
+) -> Dict[str, Any]:
+    """
+    Recompute the materialized month for every crew member at a base.
+    Use after bulk imports or writes that bypass the API (leave/standby loaders).
+    """
+    base = base_airport.strip().upper()
+    first = _parse_month(year, month)
+
+    async with get_connection() as conn:
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(
+                    "SELECT `id` FROM `crew_members` WHERE `base_airport` = %s", (base,)
+                )
+                crew_ids = [int(r["id"]) for r in await cur.fetchall()]
+                written = await refresh_crew_calendar(cur, crew_ids, first)
+            await conn.commit()
+        except Exception as e:
+            try:
+                await conn.rollback()
+            except Exception:
+                pass
+            raise HTTPException(status_code=500, detail=f"Calendar rebuild failed: {e}")
+
+    return {"base_airport": base, "month": first.strftime("%Y-%m"), "rows_written": written}
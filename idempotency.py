@@ -0,0 +1,280 @@
+# idempotency.py
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import pymysql  # used for catching IntegrityError from aiomysql/pymysql
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from db import execute, execute_rowcount, fetch_one
+
+# How long a completed result is replayed for.
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+# How long a pending claim blocks other workers before it is considered abandoned.
+# Kept far above the worst-case runtime of the wrapped handlers (a single short DB
+# transaction each): a claim that expires mid-run lets a duplicate run the handler again.
+PENDING_TTL_SECONDS = 600
+# How long a duplicate waits on another worker's pending claim before giving up.
+WAIT_TIMEOUT_SECONDS = 60
+POLL_INTERVAL_SECONDS = 0.25
+MAX_KEY_LENGTH = 200
+MAX_MEMORY_ENTRIES = 10000
+# Attempts at storing a result after the handler has already committed its work.
+COMPLETE_ATTEMPTS = 3
+# Expired rows are swept at most this often per process, SWEEP_BATCH rows at a time.
+SWEEP_INTERVAL_SECONDS = 60
+SWEEP_BATCH = 500
+
+# In-process stores: completed results and futures for requests still running here.
+# key -> (expires_at epoch, request_hash, status_code, body)
+_results: Dict[str, Tuple[float, str, int, Any]] = {}
+_inflight: Dict[str, asyncio.Future] = {}
+_last_sweep = 0.0
+
+
+def _fingerprint(payload: Any) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _epoch(dt: datetime) -> float:
+    # DB datetimes are naive UTC
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _remember(key: str, request_hash: str, status_code: int, body: Any, expires_at: float):
+    now = time.time()
+    if len(_results) >= MAX_MEMORY_ENTRIES:
+        for k in [k for k, v in _results.items() if v[0] <= now]:
+            del _results[k]
+        # still full: drop the oldest entries (dicts keep insertion order)
+        while len(_results) >= MAX_MEMORY_ENTRIES:
+            del _results[next(iter(_results))]
+    _results[key] = (expires_at, request_hash, status_code, body)
+
+
+def _replay(key: str, request_hash: str, stored_hash: str, status_code: int, body: Any):
+    if stored_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Idempotency-Key {key.split(':', 1)[-1]!r} was already used with a different request",
+        )
+    if status_code >= 400:
+        raise HTTPException(status_code=status_code, detail=body)
+    return body
+
+
+async def _claim(key: str, request_hash: str, owner: str) -> bool:
+    """Insert a pending row for `key` owned by `owner`. Returns False if another request already owns it."""
+    expires = datetime.utcnow() + timedelta(seconds=PENDING_TTL_SECONDS)
+    try:
+        await execute(
+            """
+            INSERT INTO `idempotency_keys` (`idem_key`,`request_hash`,`owner`,`state`,`expires_at`)
+            VALUES (%s,%s,%s,'pending',%s)
+            """,
+            (key, request_hash, owner, expires),
+        )
+        return True
+    except pymysql.err.IntegrityError:
+        return False
+
+
+async def _sweep_expired():
+    """Delete a bounded batch of expired rows (uses idx_idempotency_expires); best-effort."""
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < SWEEP_INTERVAL_SECONDS:
+        return
+    _last_sweep = now
+    try:
+        await execute(
+            "DELETE FROM `idempotency_keys` WHERE `expires_at` <= %s LIMIT %s",
+            (datetime.utcnow(), SWEEP_BATCH),
+        )
+    except Exception:
+        pass
+
+
+async def _load(key: str) -> Optional[Dict[str, Any]]:
+    return await fetch_one(
+        """
+        SELECT `request_hash`,`state`,`status_code`,`response_body`,`expires_at`
+        FROM `idempotency_keys` WHERE `idem_key` = %s LIMIT 1
+        """,
+        (key,),
+    )
+
+
+async def _wait_for_persisted(key: str, request_hash: str, owner: str):
+    """
+    Resolve `key` against the persisted store: claim it, take over an expired claim,
+    or wait for another worker's pending claim to finish.
+    Returns None once claimed, else the stored (request_hash, status_code, body).
+    """
+    deadline = time.monotonic() + WAIT_TIMEOUT_SECONDS
+    while True:
+        row = await _load(key)
+        if row is None:
+            if await _claim(key, request_hash, owner):
+                return None
+            continue
+
+        if row["expires_at"] <= datetime.utcnow():
+            # expired result or abandoned claim: drop it and race for a fresh claim
+            await execute(
+                "DELETE FROM `idempotency_keys` WHERE `idem_key` = %s AND `expires_at` <= %s",
+                (key, datetime.utcnow()),
+            )
+            continue
+
+        if row["state"] == "completed":
+            body = json.loads(row["response_body"]) if row["response_body"] else None
+            status_code = int(row["status_code"])
+            _remember(key, row["request_hash"], status_code, body, _epoch(row["expires_at"]))
+            return row["request_hash"], status_code, body
+
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress; retry later",
+            )
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+async def _complete(key: str, owner: str, status_code: int, body: Any) -> Optional[float]:
+    """
+    Store the result if `owner` still holds the claim, retrying transient DB errors.
+    Returns None if the claim was lost; raises if every attempt failed.
+    """
+    expires = datetime.utcnow() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    for attempt in range(COMPLETE_ATTEMPTS):
+        try:
+            updated = await execute_rowcount(
+                """
+                UPDATE `idempotency_keys`
+                SET `state` = 'completed', `status_code` = %s, `response_body` = %s, `expires_at` = %s
+                WHERE `idem_key` = %s AND `owner` = %s AND `state` = 'pending'
+                """,
+                (status_code, json.dumps(body), expires, key, owner),
+            )
+            break
+        except Exception:
+            if attempt == COMPLETE_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(POLL_INTERVAL_SECONDS * (attempt + 1))
+    if not updated:
+        return None
+    return _epoch(expires)
+
+
+async def _release(key: str, owner: str):
+    try:
+        await execute(
+            "DELETE FROM `idempotency_keys` WHERE `idem_key` = %s AND `owner` = %s AND `state` = 'pending'",
+            (key, owner),
+        )
+    except Exception:
+        pass
+
+
+async def run_idempotent(
+    idempotency_key: Optional[str],
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+):
+    """
+    Run `handler` at most once per (scope, Idempotency-Key).
+
+    Retries get the stored response (including 4xx errors) without calling the handler
+    again. Concurrent duplicates in this process wait on the original; duplicates on
+    other workers poll the persisted claim. 5xx failures are not stored, so the client
+    may retry them. Without a key the handler runs as before.
+
+    Once the handler has returned its work is committed, so the claim is never released
+    after that point. If the result cannot be stored, this response is still returned
+    and kept in memory, and the persisted claim stays pending until it expires. If the
+    claim expired while the handler ran (beyond PENDING_TTL_SECONDS) and a duplicate took
+    it over, both have run; this request gets a 409 and retries see the other's result.
+    """
+    if not idempotency_key:
+        return await handler()
+
+    idempotency_key = idempotency_key.strip()
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+    key = f"{scope}:{idempotency_key}"
+    request_hash = _fingerprint(payload)
+
+    while True:
+        cached = _results.get(key)
+        if cached is not None:
+            expires_at, stored_hash, status_code, body = cached
+            if expires_at > time.time():
+                return _replay(key, request_hash, stored_hash, status_code, body)
+            del _results[key]
+
+        pending = _inflight.get(key)
+        if pending is None:
+            break
+        # wait without inheriting the original's failure; if it did not finish
+        # with a result, loop round and run the request ourselves
+        await asyncio.wait({pending})
+        if not pending.cancelled():
+            stored_hash, status_code, body = pending.result()
+            return _replay(key, request_hash, stored_hash, status_code, body)
+
+    # register before the first await so same-process duplicates find us
+    future: asyncio.Future = asyncio.get_event_loop().create_future()
+    _inflight[key] = future
+    owner = uuid.uuid4().hex
+    claimed = False
+    handled = False
+    await _sweep_expired()
+    try:
+        stored = await _wait_for_persisted(key, request_hash, owner)
+        if stored is not None:
+            future.set_result(stored)
+            return _replay(key, request_hash, *stored)
+        claimed = True
+
+        try:
+            body = jsonable_encoder(await handler())
+            status_code = 200
+        except HTTPException as he:
+            if he.status_code >= 500:
+                raise
+            body = jsonable_encoder(he.detail)
+            status_code = he.status_code
+        handled = True
+
+        try:
+            expires_at = await _complete(key, owner, status_code, body)
+        except Exception:
+            # the work is committed: answer from memory rather than let a retry redo it
+            expires_at = time.time() + IDEMPOTENCY_TTL_SECONDS
+        if expires_at is None:
+            # our claim expired and another request took the key over; its result is the one kept
+            raise HTTPException(
+                status_code=409,
+                detail="Idempotency-Key claim expired while this request ran and was taken over; "
+                       "this request was applied, retries return the other request's result",
+            )
+        _remember(key, request_hash, status_code, body, expires_at)
+        future.set_result((request_hash, status_code, body))
+        return _replay(key, request_hash, request_hash, status_code, body)
+    except BaseException:
+        if not future.done():
+            if claimed and not handled:
+                await _release(key, owner)
+            future.cancel()
+        raise
+    finally:
+        _inflight.pop(key, None)
@@ -6,12 +6,16 @@ from db import create_pool, close_pool, database_health_check, get_pool_stats
 
 from crud import router as crew_list
 from roster import router as roster_router   # if roster.py defines a router
+from duty_calendar import router as calendar_router
+from simulation import router as simulation_router, shutdown_pool as shutdown_simulation_pool
 
 app = FastAPI(lifespan=None)  # we will use startup/shutdown below
 
 app.add_middleware(CORSMiddleware, allow_origins=["http://localhost:3000","http://localhost:5173"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 app.include_router(crew_list)
 app.include_router(roster_router)  # if roster exposes APIRouter
+app.include_router(calendar_router)
+app.include_router(simulation_router)
 
 @app.on_event("startup")
 async def on_startup():
@@ -20,3 +24,4 @@ async def on_startup():
 @app.on_event("shutdown")
 async def on_shutdown():
     await close_pool()
+    shutdown_simulation_pool()
@@ -1,18 +1,19 @@
 # roster.py
-from fastapi import APIRouter, HTTPException, Path
+from fastapi import APIRouter, HTTPException, Path, Header
 from pydantic import BaseModel
 from datetime import datetime
 import aiomysql
 import pymysql  # used for catching IntegrityError from aiomysql/pymysql
 from db import get_connection,fetch_all
+from duty_calendar import refresh_crew_calendar_for_duty
+from idempotency import run_idempotent
 
 router = APIRouter(prefix="/roster", tags=["roster"])
 
 class RosterRequest(BaseModel):
     flight_id: int
 
-@router.post("/create-roster/{base_airport}")
-async def create_roster(base_airport: str = Path(...), request: RosterRequest = None):
+async def _create_roster(base_airport: str, request: RosterRequest = None):
     base = base_airport.strip().upper()
 
     # explicit safe column list (no trailing comma)
@@ -31,13 +32,24 @@ async def create_roster(base_airport: str = Path(...), request: RosterRequest =
                     # Shouldn't happen since RosterRequest requires flight_id, but safe-check
                     raise HTTPException(status_code=400, detail="flight_id is required")
 
-                await cur.execute("SELECT `id` FROM `flights` WHERE `id` = %s LIMIT 1", (flight_id,))
+                # lock the flight row so concurrent rosters for the same flight run one at a time
+                await cur.execute("SELECT `id`,`dep_time`,`arr_time` FROM `flights` WHERE `id` = %s LIMIT 1 FOR UPDATE", (flight_id,))
                 flight_exists = await cur.fetchone()
                 if not flight_exists:
                     # No such flight — do not proceed
                     await conn.rollback()
                     raise HTTPException(status_code=400, detail=f"flight_id {flight_id} does not exist")
 
+                # a flight gets one crew set; a retry must not assign a second one
+                await cur.execute(
+                    "SELECT COUNT(*) AS n FROM `rosters` WHERE `flight_id` = %s AND `status` = 'assigned'",
+                    (flight_id,)
+                )
+                already = await cur.fetchone()
+                if already and int(already["n"]) > 0:
+                    await conn.rollback()
+                    raise HTTPException(status_code=409, detail=f"flight_id {flight_id} already has assigned crew")
+
                 # 1) select up to 4 active crew ids and lock them to avoid races
                 await cur.execute(
                     """
@@ -114,7 +126,12 @@ async def create_roster(base_airport: str = Path(...), request: RosterRequest =
                     cleaned = {k: (v.isoformat() if hasattr(v, "isoformat") else v) for k, v in crew.items()}
                     assigned.append(cleaned)
 
-                # 4) commit once
+                # 4) keep the materialized duty calendar in step with the new assignments
+                await refresh_crew_calendar_for_duty(
+                    cur, [c["id"] for c in available_crew], flight_exists["dep_time"], flight_exists["arr_time"]
+                )
+
+                # 5) commit once
                 await conn.commit()
 
                 return {
@@ -136,6 +153,22 @@ async def create_roster(base_airport: str = Path(...), request: RosterRequest =
                 pass
             # hide internals but return helpful message
             raise HTTPException(status_code=500, detail=f"Roster creation failed: {exc}")
+
+@router.post("/create-roster/{base_airport}")
+async def create_roster(
+    base_airport: str = Path(...),
+    request: RosterRequest = None,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Assign crew from `base_airport` to a flight.
+    Retries carrying the same Idempotency-Key get the original response back without re-running the transaction.
+    """
+    payload = {"base_airport": base_airport.strip().upper(), "flight_id": request.flight_id if request else None}
+    return await run_idempotent(
+        idempotency_key, "create-roster", payload, lambda: _create_roster(base_airport, request)
+    )
+
 @router.get("/rosters")
 async def get_rosters():
     try:
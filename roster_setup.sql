@@ -20,7 +20,8 @@ CREATE TABLE crew_members (
   passport_no VARCHAR(50),
   medical_valid_until DATE,
   `status` ENUM('active','inactive') DEFAULT 'active',
-  created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  KEY idx_crew_members_base (base_airport)
 );
 
 -- pilots_extra
@@ -147,6 +148,32 @@ CREATE TABLE availability_cache (
   FOREIGN KEY (crew_id) REFERENCES crew_members(id) ON DELETE CASCADE
 );
 
+-- crew_calendar (materialized per-crew month; one state byte per day:
+-- 0 off, 1 rest, 2 standby, 3 leave, 4 duty). Maintained by duty_calendar.py.
+CREATE TABLE crew_calendar (
+  crew_id INT NOT NULL,
+  month_start DATE NOT NULL,
+  base_airport VARCHAR(10),
+  states VARBINARY(31) NOT NULL,
+  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (crew_id, month_start),
+  KEY idx_crew_calendar_base_month (base_airport, month_start),
+  FOREIGN KEY (crew_id) REFERENCES crew_members(id) ON DELETE CASCADE
+);
+
+-- idempotency_keys (stored responses for retried mutating requests; see idempotency.py)
+CREATE TABLE idempotency_keys (
+  idem_key VARCHAR(255) PRIMARY KEY,
+  request_hash CHAR(64) NOT NULL,
+  owner CHAR(32) NOT NULL,
+  `state` ENUM('pending','completed') DEFAULT 'pending',
+  status_code INT,
+  response_body MEDIUMTEXT,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  expires_at DATETIME NOT NULL,
+  KEY idx_idempotency_expires (expires_at)
+);
+
 -- --------------------------
 -- Seed crew members (TEXT used for qualifications)
 -- --------------------------
@@ -0,0 +1,414 @@
+# simulation.py
+import asyncio
+import os
+from collections import ChainMap
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+import aiomysql
+from fastapi import APIRouter, HTTPException, Path
+from pydantic import BaseModel, Field
+
+from db import get_connection
+from duty_calendar import MIN_REST_HOURS
+
+router = APIRouter(prefix="/simulation", tags=["simulation"])
+
+MAX_PERIOD_DAYS = 31
+MAX_SCENARIOS = 20
+
+# Scenarios are CPU-bound pure Python, so they run in worker processes rather than threads.
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, MAX_SCENARIOS + 1))
+    return _pool
+
+
+def shutdown_pool():
+    """Stop the scenario worker processes (app shutdown)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+class ScenarioError(ValueError):
+    """A scenario edit that does not match the snapshot; reported as 400."""
+
+
+class FlightDelay(BaseModel):
+    flight_id: Optional[int] = None
+    # a flight_no delays every departure with that number in the period, unless flight_date narrows it
+    flight_no: Optional[str] = None
+    flight_date: Optional[date] = None
+    minutes: int
+
+
+class Scenario(BaseModel):
+    name: str
+    remove_crew_ids: List[int] = Field(default_factory=list)
+    # e.g. {"Captain": 3} removes the first three captains (by id) at the base
+    remove_ranks: Dict[str, int] = Field(default_factory=dict)
+    delays: List[FlightDelay] = Field(default_factory=list)
+    cancel_flight_ids: List[int] = Field(default_factory=list)
+
+
+class SimulationRequest(BaseModel):
+    start_date: date
+    end_date: date
+    scenarios: List[Scenario]
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    View of a base and period, loaded once and shared by every scenario.
+    Plain dicts and tuples so it pickles to the worker processes; treat it as read-only.
+    """
+    base_airport: str
+    crew: Mapping[int, Mapping[str, Any]]
+    flights: Mapping[int, Mapping[str, Any]]
+    # crew_id -> ((start, end), ...) of duty blocks and assigned flights outside `flights`
+    duties: Mapping[int, Tuple[Tuple[datetime, datetime], ...]]
+    # crew_id -> ((start_date, end_date), ...) of approved leave
+    leaves: Mapping[int, Tuple[Tuple[date, date], ...]]
+    # flight_id -> crew ids currently assigned
+    live_roster: Mapping[int, Tuple[int, ...]]
+    # crew switched off outside of rostering (inactive with no assigned roster row)
+    unavailable: FrozenSet[int]
+
+
+def _group(rows, key, value) -> Dict[int, tuple]:
+    out: Dict[int, list] = {}
+    for r in rows:
+        out.setdefault(int(r[key]), []).append(value(r))
+    return {k: tuple(v) for k, v in out.items()}
+
+
+async def load_snapshot(base: str, start: date, end: date) -> Snapshot:
+    """Read everything a simulation needs with plain SELECTs (no FOR UPDATE) in one transaction."""
+    async with get_connection() as conn:
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(
+                    """
+                    SELECT `id`,`crew_code`,`full_name`,`role`,`rank`,`medical_valid_until`,`status`
+                    FROM `crew_members`
+                    WHERE `base_airport` = %s
+                    ORDER BY `id`
+                    """,
+                    (base,),
+                )
+                crew_rows = await cur.fetchall()
+
+                await cur.execute(
+                    """
+                    SELECT `id`,`flight_no`,`flight_date`,`dep_airport`,`arr_airport`,
+                           `dep_time`,`arr_time`,`required_pilots`,`required_cabin`
+                    FROM `flights`
+                    WHERE `dep_airport` = %s
+                      AND `flight_date` BETWEEN %s AND %s
+                      AND `status` <> 'cancelled'
+                    ORDER BY `dep_time`, `id`
+                    """,
+                    (base, start, end),
+                )
+                flight_rows = await cur.fetchall()
+
+                crew_ids = tuple(int(r["id"]) for r in crew_rows)
+                flight_ids = tuple(int(r["id"]) for r in flight_rows)
+                duty_rows, leave_rows, roster_rows = [], [], []
+
+                # create_roster flips assigned crew to inactive, so an inactive crew member
+                # with an assigned roster row is still plannable; only the rest were switched off
+                inactive = tuple(int(r["id"]) for r in crew_rows if r["status"] != "active")
+                unavailable = set(inactive)
+                if inactive:
+                    placeholders = ",".join(["%s"] * len(inactive))
+                    await cur.execute(
+                        f"""
+                        SELECT DISTINCT `crew_id`
+                        FROM `rosters`
+                        WHERE `crew_id` IN ({placeholders})
+                          AND `status` = 'assigned'
+                        """,
+                        inactive,
+                    )
+                    unavailable -= {int(r["crew_id"]) for r in await cur.fetchall()}
+
+                if crew_ids:
+                    placeholders = ",".join(["%s"] * len(crew_ids))
+                    window_start = datetime.combine(start, datetime.min.time()) - timedelta(hours=MIN_REST_HOURS)
+                    window_end = datetime.combine(end + timedelta(days=1), datetime.min.time()) + timedelta(hours=MIN_REST_HOURS)
+                    await cur.execute(
+                        f"""
+                        SELECT `crew_id`,`start_time`,`end_time`
+                        FROM `duty_blocks`
+                        WHERE `crew_id` IN ({placeholders})
+                          AND `end_time` >= %s AND `start_time` < %s
+                        """,
+                        crew_ids + (window_start, window_end),
+                    )
+                    duty_rows = list(await cur.fetchall())
+
+                    # live assignments on flights this simulation does not re-plan (e.g. the
+                    # return leg into the base) still occupy the crew and need rest around them
+                    exclude = ""
+                    if flight_ids:
+                        exclude = f"AND f.`id` NOT IN ({','.join(['%s'] * len(flight_ids))})"
+                    await cur.execute(
+                        f"""
+                        SELECT r.`crew_id`, f.`dep_time` AS start_time, f.`arr_time` AS end_time
+                        FROM `rosters` r
+                        JOIN `flights` f ON f.`id` = r.`flight_id`
+                        WHERE r.`crew_id` IN ({placeholders})
+                          AND r.`status` = 'assigned'
+                          AND f.`status` <> 'cancelled'
+                          AND f.`arr_time` >= %s AND f.`dep_time` < %s
+                          {exclude}
+                        """,
+                        crew_ids + (window_start, window_end) + flight_ids,
+                    )
+                    duty_rows += await cur.fetchall()
+
+                    await cur.execute(
+                        f"""
+                        SELECT `crew_id`,`start_date`,`end_date`
+                        FROM `crew_leaves`
+                        WHERE `crew_id` IN ({placeholders})
+                          AND `status` = 'approved'
+                          AND `start_date` <= %s AND `end_date` >= %s
+                        """,
+                        crew_ids + (end, start),
+                    )
+                    leave_rows = await cur.fetchall()
+
+                if flight_ids:
+                    placeholders = ",".join(["%s"] * len(flight_ids))
+                    await cur.execute(
+                        f"""
+                        SELECT `flight_id`,`crew_id`
+                        FROM `rosters`
+                        WHERE `flight_id` IN ({placeholders})
+                          AND `status` = 'assigned'
+                        ORDER BY `crew_id`
+                        """,
+                        flight_ids,
+                    )
+                    roster_rows = await cur.fetchall()
+            # read-only; end the implicit transaction
+            await conn.commit()
+        except Exception:
+            try:
+                await conn.rollback()
+            except Exception:
+                pass
+            raise
+
+    return Snapshot(
+        base_airport=base,
+        crew={int(r["id"]): dict(r) for r in crew_rows},
+        flights={int(r["id"]): dict(r) for r in flight_rows},
+        duties=_group(duty_rows, "crew_id", lambda r: (r["start_time"], r["end_time"])),
+        leaves=_group(leave_rows, "crew_id", lambda r: (r["start_date"], r["end_date"])),
+        live_roster=_group(roster_rows, "flight_id", lambda r: int(r["crew_id"])),
+        unavailable=frozenset(unavailable),
+    )
+
+
+def _is_legal(
+    crew: Mapping[str, Any],
+    flight: Mapping[str, Any],
+    duties: Tuple[Tuple[datetime, datetime], ...],
+    leaves: Tuple[Tuple[date, date], ...],
+) -> bool:
+    dep, arr = flight["dep_time"], flight["arr_time"]
+    day, last_day = flight["flight_date"], arr.date()
+    medical = crew.get("medical_valid_until")
+    if medical is not None and medical < last_day:
+        return False
+    # a flight landing after midnight also touches the arrival day
+    if any(s <= last_day and day <= e for s, e in leaves):
+        return False
+    rest = timedelta(hours=MIN_REST_HOURS)
+    # every other duty must finish `rest` before departure or start `rest` after arrival
+    return all(e + rest <= dep or arr + rest <= s for s, e in duties)
+
+
+def run_scenario(snapshot: Snapshot, scenario: Scenario) -> Dict[str, Any]:
+    """
+    Apply `scenario` as copy-on-write overlays on `snapshot` and re-plan every flight.
+    Only edited records are copied; the snapshot itself is never mutated.
+    """
+    flights = ChainMap({}, snapshot.flights)
+    duties = ChainMap({}, snapshot.duties)
+
+    unknown_crew = [c for c in scenario.remove_crew_ids if int(c) not in snapshot.crew]
+    if unknown_crew:
+        raise ScenarioError(f"Scenario {scenario.name!r}: crew {unknown_crew} not based at {snapshot.base_airport}")
+    removed = {int(c) for c in scenario.remove_crew_ids}
+
+    for rank, count in scenario.remove_ranks.items():
+        of_rank = [cid for cid, c in snapshot.crew.items() if (c.get("rank") or "").lower() == rank.lower()]
+        if not of_rank:
+            raise ScenarioError(f"Scenario {scenario.name!r}: no {rank!r} crew at {snapshot.base_airport}")
+        # only crew who could actually fly count as a loss
+        matching = [cid for cid in of_rank if cid not in removed and cid not in snapshot.unavailable]
+        if count < 0 or count > len(matching):
+            raise ScenarioError(
+                f"Scenario {scenario.name!r}: cannot remove {count} {rank!r}, {len(matching)} available"
+            )
+        removed.update(sorted(matching)[:count])
+
+    for fid in scenario.cancel_flight_ids:
+        if int(fid) not in snapshot.flights:
+            raise ScenarioError(
+                f"Scenario {scenario.name!r}: flight_id {fid} does not depart {snapshot.base_airport} in this period"
+            )
+        flights.maps[0][int(fid)] = None
+
+    by_no: Dict[str, List[int]] = {}
+    for fid, f in snapshot.flights.items():
+        by_no.setdefault(f["flight_no"], []).append(fid)
+
+    for d in scenario.delays:
+        if d.flight_id is not None:
+            targets = [d.flight_id] if d.flight_id in snapshot.flights else []
+        else:
+            targets = [
+                fid for fid in by_no.get(d.flight_no, [])
+                if d.flight_date is None or snapshot.flights[fid]["flight_date"] == d.flight_date
+            ]
+        if not targets:
+            what = f"flight_id {d.flight_id}" if d.flight_id is not None else f"flight {d.flight_no}"
+            raise ScenarioError(f"Scenario {scenario.name!r}: {what} does not depart {snapshot.base_airport} in this period")
+        shift = timedelta(minutes=d.minutes)
+        for fid in targets:
+            base_row = flights.get(fid)
+            if base_row is None:
+                # cancelled in this scenario
+                continue
+            dep = base_row["dep_time"] + shift
+            flights.maps[0][fid] = {
+                **base_row,
+                "dep_time": dep,
+                "arr_time": base_row["arr_time"] + shift,
+                # a slip past midnight moves the duty day used by the leave/medical checks
+                "flight_date": dep.date(),
+            }
+
+    live = [f for f in flights.values() if f is not None]
+    live.sort(key=lambda f: (f["dep_time"], f["id"]))
+
+    assignments: Dict[int, List[int]] = {}
+    gaps = []
+    for flight in live:
+        fid = int(flight["id"])
+        pilots = int(flight["required_pilots"] or 0)
+        # the pilot requirement is one Captain plus any pilot rank for the remaining seats
+        need = {
+            "captain": 1 if pilots > 0 else 0,
+            "pilot": max(pilots - 1, 0),
+            "cabin": int(flight["required_cabin"] or 0),
+        }
+        picked: List[int] = []
+        # same ordering as create_roster: lowest crew id first
+        for cid, crew in snapshot.crew.items():
+            if cid in removed or cid in snapshot.unavailable:
+                continue
+            if crew["role"] == "pilot":
+                is_captain = (crew.get("rank") or "").lower() == "captain"
+                slot = "captain" if is_captain and need["captain"] > 0 else "pilot"
+            else:
+                slot = "cabin"
+            if need[slot] <= 0:
+                continue
+            if not _is_legal(crew, flight, duties.get(cid, ()), snapshot.leaves.get(cid, ())):
+                continue
+            picked.append(cid)
+            need[slot] -= 1
+            # copy-on-write: this crew's duty list is rebuilt only once it changes
+            duties.maps[0][cid] = duties.get(cid, ()) + ((flight["dep_time"], flight["arr_time"]),)
+            if not any(need.values()):
+                break
+        assignments[fid] = picked
+        if any(need.values()):
+            gaps.append({
+                "flight_id": fid,
+                "flight_no": flight["flight_no"],
+                "dep_time": flight["dep_time"].isoformat(),
+                "missing_captain": need["captain"],
+                "missing_pilots": need["captain"] + need["pilot"],
+                "missing_cabin": need["cabin"],
+            })
+
+    diffs = []
+    for fid in sorted(set(assignments) | set(snapshot.live_roster)):
+        before = set(snapshot.live_roster.get(fid, ()))
+        after = set(assignments.get(fid, ()))
+        if before != after:
+            diffs.append({
+                "flight_id": fid,
+                "cancelled": fid not in assignments,
+                "added": sorted(after - before),
+                "removed": sorted(before - after),
+            })
+
+    return {
+        "name": scenario.name,
+        "removed_crew_ids": sorted(removed),
+        "flights_planned": len(live),
+        "coverage_gaps": gaps,
+        "diff_vs_live": diffs,
+        "assignments": {str(fid): crew for fid, crew in assignments.items()},
+    }
+
+
+@router.post("/{base_airport}")
+async def simulate(base_airport: str = Path(...), request: SimulationRequest = None):
+    """
+    Dry-run what-if scenarios for a base and period without writing anything.
+    The snapshot is read once and shared; scenarios run in parallel in worker processes.
+    """
+    base = base_airport.strip().upper()
+    if request is None or not request.scenarios:
+        raise HTTPException(status_code=400, detail="At least one scenario is required")
+    if len(request.scenarios) > MAX_SCENARIOS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SCENARIOS} scenarios per request")
+    if request.end_date < request.start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (request.end_date - request.start_date).days + 1 > MAX_PERIOD_DAYS:
+        raise HTTPException(status_code=400, detail=f"Period is limited to {MAX_PERIOD_DAYS} days")
+
+    try:
+        snapshot = await load_snapshot(base, request.start_date, request.end_date)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load snapshot: {e}")
+
+    # baseline re-plan with no edits, so scenario diffs can be read against it too
+    scenarios = [Scenario(name="baseline")] + list(request.scenarios)
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, run_scenario, snapshot, sc) for sc in scenarios)
+        )
+    except ScenarioError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Simulation failed: {e}")
+
+    return {
+        "base_airport": base,
+        "start_date": request.start_date.isoformat(),
+        "end_date": request.end_date.isoformat(),
+        "crew_count": len(snapshot.crew),
+        "baseline": results[0],
+        "scenarios": results[1:],
+    }